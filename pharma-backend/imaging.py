@@ -0,0 +1,36 @@
+import io
+
+from PIL import Image, ImageOps
+
+# Kept apart from main.py: resize workers start via forkserver/spawn and import whatever
+# module the pooled function lives in, so this one only pulls in Pillow (no Supabase client,
+# Gemini config or log listener per worker).
+
+# Errors Pillow raises for input it can't decode (e.g. HEIC, truncated files). Anything else
+# (a dead pool worker, say) is a real failure and must not be mistaken for a bad image.
+UNDECODABLE_IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+def encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        # JPEG has no alpha; a bare convert("RGB") would turn transparent areas black
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+def resize_variants(content: bytes, max_edges: tuple, quality: int = 82) -> list:
+    """Decode once and return one JPEG per max edge, in the order given."""
+    with Image.open(io.BytesIO(content)) as img:
+        img = ImageOps.exif_transpose(img)
+        variants = {}
+        # Largest first, each smaller size downscaled from the previous one
+        for edge in sorted(set(max_edges), reverse=True):
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            variants[edge] = encode_jpeg(img, quality)
+        return [variants[edge] for edge in max_edges]
+
+def resize_image(content: bytes, max_edge: int, quality: int = 82) -> bytes:
+    return resize_variants(content, (max_edge,), quality)[0]
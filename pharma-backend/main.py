@@ -1,23 +1,81 @@
 import os
+import re
 import json
-import random
-from typing import List, Optional
+import orjson
+import asyncio
+import binascii
+import shutil
+import tempfile
+import uuid
+import time
+import secrets
+import hmac
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
 from datetime import datetime
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
+from cachetools import TTLCache
+from urllib.parse import quote
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+import httpx
 import google.generativeai as genai
+from google import genai as google_genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-import base64
+
+# pybase64 (SIMD base64) when available; binascii skips base64.b64encode's Python wrapper
+try:
+    import pybase64
+    b64encode_str = pybase64.b64encode_as_string
+except ImportError:
+    def b64encode_str(data: bytes) -> str:
+        return binascii.b2a_base64(data, newline=False).decode('ascii')
 
 # --- CONFIGURATION ---
 from pathlib import Path
 env_path = Path(__file__).resolve().parent.parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-app = FastAPI()
+# App-wide resources are opened once at startup and released at shutdown, in one place.
+# The names used here (model, log_listener, RESIZE_POOL, ...) are defined further down.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One async client for all hand-rolled outbound HTTP (Storage uploads, image downloads).
+    # Creating a client per request re-handshakes TLS every time and can leak sockets.
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=httpx.Timeout(30, connect=5),
+    )
+    await warm_up_gemini()
+    # Pollers from before the last restart are gone; pick their jobs back up in the background
+    resume_task = asyncio.create_task(resume_batch_jobs())
+    sweep_task = asyncio.create_task(sweep_stale_originals())
+    yield
+    resume_task.cancel()
+    sweep_task.cancel()
+    for task in list(BATCH_POLLERS.values()):
+        task.cancel()
+    await app.state.http.aclose()
+    supabase_http.close()
+    RESIZE_POOL.shutdown(wait=False, cancel_futures=True)
+    log_listener.stop()
+
+# orjson for response bodies (verdicts, review lists) instead of stdlib json.
+# (Our own subclass: FastAPI's ORJSONResponse is deprecated and warns on every response.)
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(default_response_class=OrjsonResponse, lifespan=lifespan)
 
 # FastAPI defers this to the ASGI server. Uvicorn default is fine for normal use, 
 # but for 50MB uploads we might rely on default behavior which doesn't strictly impose 
@@ -25,13 +83,48 @@ app = FastAPI()
 
 # --- LOGGING FIX FOR RENDER ---
 import sys
-# Force unbuffered output so print() shows up in Render logs immediately
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+# Force unbuffered output so logs show up in Render logs immediately
 sys.stdout.reconfigure(line_buffering=True)
 
+# Endpoints only enqueue log records; formatting and the (locked, flushed) stdout write
+# happen on the QueueListener's background thread instead of on the event loop.
+log_queue = queue.SimpleQueue()
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+log_listener = QueueListener(log_queue, stdout_handler)
+log_listener.start()
+# QueueHandler.prepare() pre-formats each record with the handler's own formatter; keep that
+# to the bare message so the listener's formatter adds the timestamp/level exactly once.
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter("%(message)s"))
+# Root stays at WARNING so library chatter (httpx/httpcore log every request at INFO)
+# doesn't flood the queue; only our own logger runs at INFO.
+logging.basicConfig(level=logging.WARNING, handlers=[queue_handler])
+logger = logging.getLogger("pharma")
+logger.setLevel(logging.INFO)
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "Pharma Grid Backend"}
 
+# --- Bail on oversized bodies from the Content-Length header ---
+# Multipart parsing happens before the endpoint runs, so per-file checks alone still let a
+# huge body be spooled first. Registered before CORS so the 413 still carries CORS headers.
+MAX_REQUEST_BYTES = 64 * 1024 * 1024  # covers the 50MB video upload plus form overhead
+
+@app.middleware("http")
+async def reject_oversized_requests(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"Request body exceeds {MAX_REQUEST_BYTES // (1024 * 1024)}MB."}
+        )
+    return await call_next(request)
+
 # CORS Setup
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +134,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Review/profile lists repeat the same keys on every row and compress well;
+# tiny responses aren't worth the CPU.
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 safety_config = {
     HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
     HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
@@ -55,85 +152,316 @@ SUPABASE_ANON_KEY = os.getenv("VITE_SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("VITE_SUPABASE_SERVICE_ROLE_KEY")
 
 if not GEMINI_API_KEY or not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    print("WARNING: Missing API Keys in .env")
+    logger.warning("Missing API Keys in .env")
 
 # Initialize Clients
 # Use Service Role Key for backend administration (Bypasses RLS) if available
 supabase_key = SUPABASE_SERVICE_ROLE_KEY if SUPABASE_SERVICE_ROLE_KEY else SUPABASE_ANON_KEY
 if not SUPABASE_SERVICE_ROLE_KEY:
-    print("⚠️ WARNING: Using Anon Key. Functionality like Storage Uploads may fail due to RLS.")
+    logger.warning("⚠️ Using Anon Key. Functionality like Storage Uploads may fail due to RLS.")
 else:
-    print("🔐 Using Service Role Key (Admin Access)")
+    logger.info("🔐 Using Service Role Key (Admin Access)")
+
+# Shared, pooled HTTP client for PostgREST + Storage so concurrent requests reuse warm
+# keep-alive (HTTP/2) connections instead of paying a TCP+TLS handshake each time.
+supabase_http = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30),
+    timeout=30,
+)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    supabase_key,
+    options=ClientOptions(httpx_client=supabase_http),
+)
 
-supabase: Client = create_client(SUPABASE_URL, supabase_key)
+# Storage REST endpoint, called through the shared async httpx client: uploads post the
+# (already resized) bytes without blocking the loop, and direct-upload read-backs stream.
+STORAGE_OBJECT_URL = f"{(SUPABASE_URL or '').rstrip('/')}/storage/v1/object/"
+
+# 'device-images' is a public bucket, so object URLs are a fixed template (no SDK call needed)
+PUBLIC_BUCKET_PREFIX = f"{(SUPABASE_URL or '').rstrip('/')}/storage/v1/object/public/device-images/"
+
+# The async Gemini calls go over one long-lived gRPC channel (HTTP/2) created on first
+# use, so connections are already reused; warm_up_gemini opens it at boot.
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-flash-latest', safety_settings=safety_config)
 
+GEMINI_WARMUP_TIMEOUT = 5  # seconds
+
+async def warm_up_gemini():
+    # The SDK opens its channel (TLS, auth) lazily; pay that once at boot, not on the first audit
+    try:
+        # Bounded: an unreachable Gemini endpoint must not hold up startup / health checks
+        await asyncio.wait_for(
+            model.generate_content_async("ping", generation_config={"max_output_tokens": 1}),
+            timeout=GEMINI_WARMUP_TIMEOUT,
+        )
+        logger.info("🔥 Gemini client warmed up")
+    except Exception as e:
+        logger.warning("⚠️ Gemini warm-up failed: %r", e)
+
+# google-genai client, used for Batch Mode jobs (not exposed by google-generativeai)
+batch_client = google_genai.Client(api_key=GEMINI_API_KEY)
+
 # --- Agno Agent ---
-from medical_agent import get_agent_response
+from medical_agent import get_agent_response_async
+from imaging import UNDECODABLE_IMAGE_ERRORS, resize_image, resize_variants
+
+# --- HELPER: Run blocking Supabase calls off the event loop ---
+# supabase-py is synchronous; executing a query inside an async endpoint would stall
+# every other request on this worker for the full round trip.
+async def run_query(query):
+    return await asyncio.to_thread(query.execute)
+
+# Chunk size for copying/streaming bodies (video temp file, Storage read-backs)
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+
+# --- HELPER: Read a whole upload ---
+# One read from the spooled part (collecting chunks and joining them costs an extra full
+# copy); the spooled file is closed right away so only the returned bytes stay alive.
+async def read_upload(file: UploadFile) -> bytes:
+    await file.seek(0)
+    content = await file.read()
+    await file.close()
+    return content
+
+# --- HELPER: Downscale + re-encode images ---
+# Phone photos are far larger than needed: ~1024px is plenty for Gemini (billed per image
+# token) and the gallery/grid never renders beyond 1600px/400px.
+AUDIT_IMAGE_EDGE = 1024
+LISTING_IMAGE_EDGE = 1600
+THUMB_IMAGE_EDGE = 400
+
+# LANCZOS resampling is CPU-bound and holds the GIL, so threads only overlap the I/O.
+# A process pool lets the per-image resizes of one request actually run in parallel.
+# forkserver (spawn where unavailable) instead of fork: forking a process that already runs
+# the event loop, the httpx pool and the log listener thread can deadlock the children.
+RESIZE_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# Capped so a many-core host doesn't hold a Pillow-sized worker per core per uvicorn worker
+RESIZE_WORKERS = min(os.cpu_count() or 1, 4)
+
+def new_resize_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=RESIZE_WORKERS, mp_context=RESIZE_MP_CONTEXT)
+
+RESIZE_POOL = new_resize_pool()
+
+async def run_in_resize_pool(fn, *args):
+    global RESIZE_POOL
+    pool = RESIZE_POOL
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker died (OOM-killed, codec crash) and the pool rejects every later task:
+        # swap in a fresh one and let this request fail instead of degrading silently.
+        if RESIZE_POOL is pool:
+            logger.error("❌ Resize pool broken, recreating it")
+            RESIZE_POOL = new_resize_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+async def resize_in_pool(content: bytes, max_edge: int) -> bytes:
+    return await run_in_resize_pool(resize_image, content, max_edge)
+
+# --- HELPER: Reject bad image uploads before processing them ---
+# By the time the endpoint runs Starlette has already received and spooled the whole body
+# (only reject_oversized_requests bounds that). These checks use part headers plus a
+# 12-byte magic sniff, so a mislabelled file is turned away before any resize, Storage
+# upload or Gemini call is spent on it.
+MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10MB per image
+MAX_IMAGES_PER_REQUEST = 10
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix"):
+        return "image/heic"  # iPhone
+    if head[4:8] == b"ftyp" and head[8:12] in (b"mif1", b"msf1"):
+        return "image/heif"
+    return None
+
+def is_image_signature(head: bytes) -> bool:
+    return sniff_image_type(head) is not None
+
+def check_image_uploads(images: List[UploadFile]):
+    if len(images) > MAX_IMAGES_PER_REQUEST:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"Upload at most {MAX_IMAGES_PER_REQUEST} images per request."}
+        )
+    for file in images:
+        if not (file.content_type or "").startswith("image/"):
+            return JSONResponse(
+                status_code=415,
+                content={"error": f"'{file.filename}' is not an image ({file.content_type})."}
+            )
+        if file.size is not None and file.size > MAX_IMAGE_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"error": f"'{file.filename}' exceeds the {MAX_IMAGE_BYTES // (1024 * 1024)}MB image limit."}
+            )
+        # The content type is client-supplied; the first bytes tell us what the file really is.
+        # A 12-byte read from the spooled part is cheap next to a resize or a Gemini call.
+        head = file.file.read(12)
+        file.file.seek(0)
+        if not is_image_signature(head):
+            return JSONResponse(
+                status_code=415,
+                content={"error": f"'{file.filename}' is not a JPEG, PNG, WebP, GIF or HEIC image."}
+            )
+    return None
+
+# Cap concurrent Gemini calls (per-image fan-out can otherwise blow through RPM limits).
+# Excess calls wait here cheaply instead of piling up open sockets and image buffers;
+# tune per deployment / quota tier via GEMINI_CONCURRENCY.
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+GEMINI_SEMAPHORE = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+# --- HELPER: Token-trim prompt text ---
+# Indentation and runs of spaces are billed as input tokens on every call but carry no
+# meaning for the model; prompts are compacted once, at import.
+def compact_prompt(text: str) -> str:
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+# --- MODELS: Gemini verdict shapes (mirror the JSON each prompt asks for) ---
+# Validated straight from the raw JSON text by pydantic-core, so a malformed verdict is a
+# ValidationError instead of a KeyError somewhere downstream.
+class AuditVerdict(BaseModel):
+    status: Literal["verified", "rejected", "needs_more_info"]
+    item_identified: str = ""
+    safety_score: int = 0
+    flaws_found: List[str] = []
+    reason: str = ""
+    missing_evidence: Optional[str] = None
+
+class VideoVerdict(BaseModel):
+    is_medical: bool
+    is_safe: bool
+    item_name: str = ""
+    flaws: List[str] = []
+    summary: str = ""
+
+class ReturnVerdict(BaseModel):
+    status: Literal["clear", "damage_reported"]
+    new_damage_found: List[str] = []
+    analysis: str = ""
+    suggested_deduction: float = 0
+
+# --- HELPER: Pydantic model -> Gemini response_schema ---
+# Gemini's schema dialect is an OpenAPI subset: no titles/defaults, Optional is
+# `nullable`, and type names are upper-case enum values. Every field is marked required
+# so the model always emits it; the model defaults remain a safety net when parsing.
+def gemini_schema(node):
+    if isinstance(node, list):
+        return [gemini_schema(n) for n in node]
+    if not isinstance(node, dict):
+        return node
+    if "anyOf" in node:
+        inner = next(n for n in node["anyOf"] if n.get("type") != "null")
+        return {**gemini_schema(inner), "nullable": True}
+    out = {k: gemini_schema(v) for k, v in node.items() if k not in ("title", "default", "required")}
+    if "type" in out:
+        out["type"] = out["type"].upper()
+    if "properties" in out:
+        out["required"] = list(out["properties"])
+    return out
+
+def json_generation_config(schema: type[BaseModel]) -> dict:
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": gemini_schema(schema.model_json_schema()),
+    }
+
+# Built once at import, not per call
+GENERATION_CONFIGS = {m: json_generation_config(m) for m in (AuditVerdict, VideoVerdict, ReturnVerdict)}
+
+# --- HELPER: Parse JSON from Markdown ---
+# One scan for the outermost {...} instead of stripping ``` fences with repeated replace()
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+
+def parse_gemini_json(raw_text: str, schema: Optional[type[BaseModel]] = None):
+    match = JSON_OBJECT_RE.search(raw_text)
+    if not match:
+        raise ValueError("No JSON object in Gemini response")
+    if schema is not None:
+        return schema.model_validate_json(match.group(0)).model_dump()
+    return orjson.loads(match.group(0))
 
 # --- HELPER: Call Gemini API ---
 # We use a helper to keep the endpoints clean, mimicking the Node structure
-async def call_gemini(prompt_text: str, file_parts: list):
+# contents format expected: [prompt, image1, image2...] where images are blob dicts with
+# raw bytes: {"mime_type": "...", "data": b"..."} ('generate_content' accepts them as-is)
+async def call_gemini(contents: list, schema: Optional[type[BaseModel]] = None):
     try:
-        # Construct content for Gemini
-        # file_parts format expected: [{"mime_type": "...", "data": b64_bytes}] 
-        # But google-generativeai lib usage is usually: [prompt, image1, image2...]
-        # Here we will adapt to the library's preferred input format.
-        
-        contents = [prompt_text]
-        for part in file_parts:
-            # part is {"mime_type": ..., "data": ...} (base64 string)
-            # The python lib 'generate_content' accepts a list where items can be 
-            # simple dicts for blobs: {'mime_type': '...', 'data': b'...'} 
-            # Note: 'data' requires items to be raw bytes, not base64 string if using the dict format directly 
-            # OR we can just pass the same structure if we construct the Request object manually.
-            # However, easier way with this lib is:
-            contents.append({
-                "mime_type": part["mime_type"],
-                "data": base64.b64decode(part["data"])
-            })
-
-        response = model.generate_content(contents)
+        # Async variant so a slow Gemini call doesn't block the event loop
+        async with GEMINI_SEMAPHORE:
+            response = await model.generate_content_async(
+                contents,
+                # Structured output: decoding is constrained to the schema, so the reply is
+                # bare JSON (no fences or prose) and can be validated directly
+                generation_config=GENERATION_CONFIGS[schema] if schema else None,
+            )
         
         if not response.text:
              raise Exception("Empty response from Gemini")
-             
-        # Parse JSON from Markdown
-        raw_text = response.text
-        json_string = raw_text.replace("```json", "").replace("```", "").strip()
-        return json.loads(json_string)
+
+        if schema is not None:
+            return schema.model_validate_json(response.text).model_dump()
+        return parse_gemini_json(response.text)
 
     except Exception as e:
-        print(f"Gemini Error: {e}")
+        logger.error("Gemini Error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# --- HELPER: Merge per-image audit verdicts ---
+def merge_audit_verdicts(verdicts: list) -> dict:
+    """Combine independent per-image verdicts into one listing verdict (strictest wins)."""
+    statuses = {v.get("status") for v in verdicts}
+    if "rejected" in statuses:
+        status = "rejected"
+    elif statuses == {"verified"}:
+        status = "verified"
+    else:
+        status = "needs_more_info"
+
+    # Most frequently identified name wins
+    names = [v.get("item_identified") for v in verdicts if v.get("item_identified")]
+    item_identified = max(set(names), key=names.count) if names else "Unknown"
+
+    # Union of flaws / reasons, preserving order and dropping duplicates
+    flaws_found = list(dict.fromkeys(f for v in verdicts for f in (v.get("flaws_found") or [])))
+    reasons = list(dict.fromkeys(v.get("reason") for v in verdicts if v.get("reason")))
+
+    missing_evidence = ""
+    if status == "needs_more_info":
+        missing = dict.fromkeys(v.get("missing_evidence") for v in verdicts if v.get("missing_evidence"))
+        missing_evidence = " ".join(missing)
+
+    return {
+        "status": status,
+        "item_identified": item_identified,
+        "safety_score": min((v["safety_score"] for v in verdicts if v.get("safety_score") is not None), default=0),
+        "flaws_found": flaws_found,
+        "reason": " ".join(reasons),
+        "missing_evidence": missing_evidence,
+    }
+
+
 # ==========================================
 #  FEATURE 1: UNIVERSAL MEDICAL AUDITOR (Multi-Image)
 # ==========================================
-@app.post("/audit-item")
-async def audit_item(images: List[UploadFile] = File(...)):
-    if len(images) < 2:
-        return JSONResponse(
-            status_code=400,
-            content={"error": "Please upload at least 2 images (different angles) to verify safety."}
-        )
-
-    print(f"🕵️ Auditing {len(images)} images...")
-
-    try:
-        # 1. Prepare Images for Gemini
-        file_parts = []
-        for file in images:
-            content = await file.read()
-            file_parts.append({
-                "mime_type": file.content_type,
-                "data": base64.b64encode(content).decode('utf-8') 
-            })
-
-        # 2. The Universal Prompt
-        prompt_text = """
+# The Universal Prompt (all photos in one request: /audit-item-batch)
+AUDIT_PROMPT = compact_prompt("""
           You are an expert AI Biomedical Engineer and Safety Inspector.
           Analyze these photos of a pre-owned item being listed for rental/sale.
 
@@ -172,37 +500,301 @@ async def audit_item(images: List[UploadFile] = File(...)):
             "reason": "string (Professional assessment)",
             "missing_evidence": "string" (If you cannot see the Screen, or the Cuff, or the Expiry Date, ask for it specifically.)
           }
-        """
+""")
+
+# Per-photo variant for /audit-item, which sends each image in its own call. A single photo
+# can't show every angle, so it is only judged on what it shows; the verdicts are then
+# merged strictest-first by merge_audit_verdicts.
+AUDIT_IMAGE_PROMPT = compact_prompt("""
+          You are an expert AI Biomedical Engineer and Safety Inspector.
+          Analyze this photo of a pre-owned item being listed for rental/sale.
+          It is ONE of several angles submitted for the same listing. Each angle is inspected
+          separately, so judge only what THIS photo shows.
+
+          --- PHASE 1: IDENTIFICATION ---
+          Identify the item. 
+          - Is it a recognizable medical device, healthcare aid, or pharmaceutical product? 
+          - (Examples: BP Monitor, Glucometer, CPAP, Nebulizer, Walker, Hospital Bed, Smart Watch with Health features, Pills, Syrups etc.)
+          - If it is NOT medical (e.g., a toaster, a toy, a gaming console), REJECT it immediately.
 
-        # 3. Get Verdict
-        result = await call_gemini(prompt_text, file_parts)
+          --- PHASE 2: DYNAMIC SAFETY CHECK ---
+          Based on the item identified, check the failure points VISIBLE in this photo:
+          
+          A. ELECTRONICS (BP Monitors, Thermometers, Oximeters):
+             - Is the screen cracked or "bleeding" pixels?
+             - Are battery compartments clean (no white acid corrosion)?
+             - Are wires/cuffs frayed or peeling?
+          
+          B. MECHANICAL / MOBILITY (Walkers, Crutches, Wheelchairs):
+             - Are rubber tips/feet worn out?
+             - Is there rust on joints?
+             - Are brakes functional (if visible)?
+          
+          C. STERILE/CONSUMABLES (Pills, Test Strips, Syrups):
+             - Is the Factory Seal intact?
+             - If the Expiry Date is visible, is it future-dated?
+             - Is the box crushed or water-damaged?
+
+          --- PHASE 3: VERDICT ---
+          Use "needs_more_info" only when THIS photo cannot be judged (blurred, too dark, item
+          not in frame). A part being out of view is not a reason: other angles cover it.
+          Return strictly valid JSON:
+          {
+            "status": "verified" | "rejected" | "needs_more_info",
+            "item_identified": "string (The specific name, e.g., 'Omron BP Monitor')",
+            "safety_score": number (1-10, where 10 is factory new),
+            "flaws_found": ["string", "string"], 
+            "reason": "string (Professional assessment)",
+            "missing_evidence": "string" (What is wrong with this photo, e.g. 'Too blurry to read the screen'.)
+          }
+""")
+
+# --- HELPER: Read + downscale one audit image into a Gemini part ---
+async def prepare_audit_image(file: UploadFile) -> dict:
+    content = await read_upload(file)
+    try:
+        content = await resize_in_pool(content, AUDIT_IMAGE_EDGE)
+        mime_type = "image/jpeg"
+    except UNDECODABLE_IMAGE_ERRORS as resize_err:
+        # Undecodable locally (e.g. HEIC): let Gemini have the original
+        logger.warning("Could not resize %s: %s", file.filename, resize_err)
+        mime_type = file.content_type
+    return {
+        "mime_type": mime_type,
+        "data": content
+    }
+
+@app.post("/audit-item")
+async def audit_item(images: List[UploadFile] = File(...)):
+    if len(images) < 2:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Please upload at least 2 images (different angles) to verify safety."}
+        )
+
+    invalid = check_image_uploads(images)
+    if invalid:
+        return invalid
+
+    logger.info("🕵️ Auditing %d images...", len(images))
+
+    try:
+        # 1. Prepare Images for Gemini (independent per image, so read + resize them concurrently)
+        file_parts = await asyncio.gather(*(prepare_audit_image(file) for file in images))
+
+        # 2. Get Verdicts (one Gemini call per image, run concurrently)
+        # Raw bytes go straight into the request proto; no base64 string is built on our side.
+        verdicts = await asyncio.gather(
+            *(call_gemini([AUDIT_IMAGE_PROMPT, part], AuditVerdict) for part in file_parts),
+            return_exceptions=True
+        )
+        failed = [idx for idx, v in enumerate(verdicts) if isinstance(v, BaseException)]
+        if len(failed) == len(verdicts):
+            raise verdicts[0]
+
+        # An image that couldn't be audited must not let the others verify the listing
+        verdicts = [
+            {
+                "status": "needs_more_info",
+                "missing_evidence": f"Photo {idx + 1} could not be analysed, please upload it again.",
+            } if idx in failed else v
+            for idx, v in enumerate(verdicts)
+        ]
+        result = merge_audit_verdicts(verdicts)
         
-        print("✅ Audit Verdict:", result)
+        logger.info("✅ Audit Verdict (%d/%d images audited): %s", len(verdicts) - len(failed), len(verdicts), result)
         return result
 
     except Exception as e:
-        print("Audit Error:", e)
+        logger.error("Audit Error: %s", e)
         # In case of error, we can return 500
         return JSONResponse(status_code=500, content={"error": "Audit Failed"})
 
 
+# ==========================================
+#  FEATURE 1.5: BATCH RE-AUDIT (Gemini Batch Mode)
+# ==========================================
+# Non-interactive audits (admin re-audits of existing listings) don't need a real-time
+# verdict, so they go through Gemini Batch Mode: one JSONL job, results within 24h, 50% cost.
+BATCH_MODEL = "gemini-2.5-flash"
+BATCH_POLL_SECONDS = 60
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+async def build_batch_request(client: httpx.AsyncClient, item: dict):
+    """Download a listing's images and wrap them in a Batch Mode request line."""
+    parts = [{"text": AUDIT_PROMPT}]
+    for url in item.get("images") or [item.get("image_url")]:
+        if not url or not url.startswith('http'): continue
+        try:
+            resp = await client.get(url)
+            if resp.status_code == 200:
+                parts.append({"inline_data": {
+                    "mime_type": resp.headers.get("content-type", "image/jpeg"),
+                    # JSONL has no binary type, so inline blobs must be base64 here
+                    "data": b64encode_str(resp.content)
+                }})
+        except Exception as img_err:
+            logger.warning("Failed to download image %s: %s", url, img_err)
+
+    if len(parts) == 1:
+        return None
+    return {"key": item["id"], "request": {
+        "contents": [{"role": "user", "parts": parts}],
+        "generation_config": GENERATION_CONFIGS[AuditVerdict],
+    }}
+
+async def apply_batch_results(job_name: str):
+    """Poll a Batch Mode job until it finishes, then write verdicts back to 'items'."""
+    try:
+        while True:
+            job = await asyncio.to_thread(batch_client.batches.get, name=job_name)
+            if job.state.name in BATCH_DONE_STATES:
+                break
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            logger.warning("⚠️ Batch %s ended with %s", job_name, job.state.name)
+            await run_query(supabase.table("items").update({"ai_batch_job": None}).eq("ai_batch_job", job_name))
+            return
+
+        raw = await asyncio.to_thread(batch_client.files.download, file=job.dest.file_name)
+        for line in raw.decode('utf-8').splitlines():
+            if not line.strip(): continue
+            entry = orjson.loads(line)
+            item_id = entry.get("key")
+            try:
+                text = entry["response"]["candidates"][0]["content"]["parts"][0]["text"]
+                verdict = parse_gemini_json(text, AuditVerdict)
+            except Exception as parse_err:
+                logger.warning("⚠️ Batch result for %s unusable: %s", item_id, entry.get('error') or parse_err)
+                continue
+
+            ai_reason = f"Score: {verdict.get('safety_score', 0)}/10. {verdict.get('reason') or ''}"
+            if verdict.get("flaws_found"):
+                ai_reason += f" Flaws: {', '.join(verdict['flaws_found'])}"
+
+            # Scoped to this job: a listing re-audited or re-queued since must keep its newer verdict
+            await run_query(supabase.table("items").update({
+                "ai_status": "verified" if verdict.get("status") == "verified" else "pending",
+                "ai_reason": ai_reason,
+                "ai_batch_job": None,
+            }).eq("id", item_id).eq("ai_batch_job", job_name))
+
+        # Rows whose result was unusable would otherwise point at this finished job forever
+        # (and be re-polled on every restart)
+        await run_query(supabase.table("items").update({"ai_batch_job": None}).eq("ai_batch_job", job_name))
+        logger.info("✅ Batch %s applied", job_name)
+
+    except Exception as e:
+        logger.error("❌ Batch Poll Error (%s): %s", job_name, e)
+
+# Pollers live as module-level tasks keyed by job name (not per-request BackgroundTasks), so
+# jobs recorded in items.ai_batch_job can be picked up again after a restart or deploy.
+BATCH_POLLERS = {}
+
+def poll_batch_job(job_name: str):
+    if job_name in BATCH_POLLERS:
+        return
+    task = asyncio.create_task(apply_batch_results(job_name))
+    BATCH_POLLERS[job_name] = task
+    task.add_done_callback(lambda _: BATCH_POLLERS.pop(job_name, None))
+
+async def resume_batch_jobs():
+    """Restart polling for every batch job still recorded on a listing."""
+    try:
+        res = await run_query(supabase.table("items").select("ai_batch_job").not_.is_("ai_batch_job", "null"))
+        job_names = {row["ai_batch_job"] for row in res.data or []}
+        for job_name in job_names:
+            poll_batch_job(job_name)
+        if job_names:
+            logger.info("🔁 Resumed polling for %d batch jobs", len(job_names))
+    except Exception as e:
+        logger.warning("⚠️ Could not resume batch jobs: %s", e)
+
+# Listings whose images are downloaded at once while building a batch file
+BATCH_DOWNLOAD_CONCURRENCY = 8
+
+async def write_batch_jsonl(items: list) -> tuple:
+    """Build each listing's request line and stream it to a temp JSONL file; returns (path, keys)."""
+    semaphore = asyncio.Semaphore(BATCH_DOWNLOAD_CONCURRENCY)
+
+    async def build(item):
+        async with semaphore:
+            return await build_batch_request(app.state.http, item)
+
+    tmp = tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False)
+    # Serialize + write off the event loop; each (base64-heavy) line is dropped once written
+    def write_line(line):
+        tmp.write(json.dumps(line) + "\n")
+
+    keys = []
+    try:
+        for next_line in asyncio.as_completed([build(item) for item in items]):
+            line = await next_line
+            if line:
+                await asyncio.to_thread(write_line, line)
+                keys.append(line["key"])
+    except BaseException:
+        tmp.close()
+        os.remove(tmp.name)
+        raise
+    tmp.close()
+    return tmp.name, keys
+
+@app.post("/audit-item-batch")
+async def audit_item_batch(payload: dict = Body(...)):
+    # payload expects {"itemIds": [...]}
+    item_ids = payload.get("itemIds") or []
+    if not item_ids:
+        raise HTTPException(status_code=400, detail="Missing itemIds")
+
+    logger.info("🗂️ Queueing batch audit for %d items...", len(item_ids))
+
+    try:
+        items_res = await run_query(supabase.table("items").select("id, image_url, images").in_("id", item_ids))
+        if not items_res.data:
+            return JSONResponse(status_code=404, content={"error": "No items found"})
+
+        # 1. Write the JSONL source file and hand it to the Files API
+        jsonl_path, queued_ids = await write_batch_jsonl(items_res.data)
+        if not queued_ids:
+            os.remove(jsonl_path)
+            return JSONResponse(status_code=400, content={"error": "No downloadable images for these items"})
+        try:
+            src = await asyncio.to_thread(
+                batch_client.files.upload,
+                file=jsonl_path,
+                config={"display_name": "pharma-grid-audit", "mime_type": "jsonl"}
+            )
+        finally:
+            os.remove(jsonl_path)
+
+        # 2. Submit the job and remember it on each listing
+        job = await asyncio.to_thread(
+            batch_client.batches.create,
+            model=BATCH_MODEL,
+            src=src.name,
+            config={"display_name": "pharma-grid-audit"}
+        )
+        await run_query(supabase.table("items").update({"ai_batch_job": job.name}).in_("id", queued_ids))
+
+        poll_batch_job(job.name)
+
+        logger.info("📬 Batch Job %s queued for %d items", job.name, len(queued_ids))
+        return {"success": True, "job": job.name, "queued": queued_ids}
+
+    except Exception as e:
+        logger.error("❌ Batch Audit Error: %s", e)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
 # ==========================================
 #  FEATURE 2: VIDEO AUDITOR (Optional/Bonus)
 # ==========================================
 # ==========================================
 #  FEATURE 2: VIDEO AUDITOR (Optional/Bonus)
 # ==========================================
-@app.post("/analyze-video")
-async def analyze_video(video: UploadFile = File(...)):
-    print("🎥 Analyzing Video...")
-    try:
-        content = await video.read()
-        file_part = [{
-            "mime_type": video.content_type,
-            "data": base64.b64encode(content).decode('utf-8')
-        }]
-
-        prompt_text = """
+VIDEO_PROMPT = compact_prompt("""
           You are a Safety Officer. Watch this video of a medical item.
           1. IDENTIFY: What item is this?
           2. FLAW CHECK: Look for wobbling wheels, rust, broken seals, or strange noises.
@@ -215,15 +807,63 @@ async def analyze_video(video: UploadFile = File(...)):
             "flaws": ["string"], 
             "summary": "string"
           }
-        """
+""")
+
+# --- HELPER: Hand a large upload to the Gemini Files API ---
+# Inline parts put the whole video in the request body (and in our RAM); the Files API
+# takes a resumable upload straight from disk and the model call only carries a file URI.
+FILE_POLL_SECONDS = 2
+# Give up on a file stuck in PROCESSING instead of holding the request open indefinitely
+FILE_PROCESSING_TIMEOUT = 120
+
+async def upload_gemini_file(file: UploadFile):
+    def upload():
+        # The spooled part may still be in memory; the SDK uploads from a path
+        with tempfile.NamedTemporaryFile(suffix=Path(file.filename or "").suffix) as tmp:
+            file.file.seek(0)
+            shutil.copyfileobj(file.file, tmp, UPLOAD_CHUNK_SIZE)
+            tmp.flush()
+            return genai.upload_file(tmp.name, mime_type=file.content_type)
+
+    handle = await asyncio.to_thread(upload)
+    # Videos are processed server-side before they can be referenced in a prompt
+    deadline = time.monotonic() + FILE_PROCESSING_TIMEOUT
+    while handle.state.name == "PROCESSING":
+        if time.monotonic() >= deadline:
+            # The caller never sees this handle, so clean it up here
+            try:
+                await asyncio.to_thread(genai.delete_file, handle.name)
+            except Exception as cleanup_err:
+                logger.warning("Could not delete Gemini file %s: %s", handle.name, cleanup_err)
+            raise TimeoutError(f"Gemini file {handle.name} still processing after {FILE_PROCESSING_TIMEOUT}s")
+        await asyncio.sleep(FILE_POLL_SECONDS)
+        handle = await asyncio.to_thread(genai.get_file, handle.name)
+    if handle.state.name != "ACTIVE":
+        raise RuntimeError(f"Gemini file {handle.name} ended in state {handle.state.name}")
+    return handle
 
-        result = await call_gemini(prompt_text, file_part)
-        print("✅ Video Verdict:", result)
+@app.post("/analyze-video")
+async def analyze_video(video: UploadFile = File(...)):
+    logger.info("🎥 Analyzing Video...")
+    handle = None
+    try:
+        handle = await upload_gemini_file(video)
+        await video.close()
+
+        result = await call_gemini([VIDEO_PROMPT, handle], VideoVerdict)
+        logger.info("✅ Video Verdict: %s", result)
         return result
 
     except Exception as e:
-        print("Video Error:", e)
+        logger.error("Video Error: %s", e)
         return JSONResponse(status_code=500, content={"error": "Video Analysis Failed"})
+    finally:
+        # Uploaded files otherwise linger (and count against quota) for 48h
+        if handle is not None:
+            try:
+                await asyncio.to_thread(genai.delete_file, handle.name)
+            except Exception as cleanup_err:
+                logger.warning("Could not delete Gemini file %s: %s", handle.name, cleanup_err)
 
 
 # ==========================================
@@ -232,18 +872,47 @@ async def analyze_video(video: UploadFile = File(...)):
 # ==========================================
 #  FEATURE 2.5: RETURN ITEM AUDITOR
 # ==========================================
+RETURN_PROMPT = compact_prompt("""
+          You are a Return Inspection Officer for medical equipment ranges.
+          Item: {item_title}
+          
+          CONTEXT:
+          I have provided {total_count} images total.
+          - The FIRST {original_count} images are the ORIGINAL CONDITION (Reference photos taken when listed).
+          - The LAST {new_count} images are the RETURN CONDITION (Current photos taken now).
+          
+          ORIGINAL SAFETY REPORT (Text):
+          "{original_condition}"
+          
+          TASK:
+          1. Analyze the Original Images (First {original_count}) to understand the baseline state.
+          2. Compare the Return Images (Last {new_count}) against those Original Images.
+          3. Look for NEW significant damages (cracks, water damage, broken parts) that were NOT present in the Original Images.
+          
+          Normal wear and tear (minor scratches) is acceptable.
+          
+          If successful return (no new damage), suggested_deduction should be 0.
+          If new damage found, estimate a fair deduction amount in Indian Rupees (INR) from the deposit.
+          
+          Return strictly valid JSON:
+          {{
+            "status": "clear" | "damage_reported",
+            "new_damage_found": ["string", "string"] (List specific new flaws, empty if none),
+            "analysis": "string (Short comparison summary citing specific differences between old and new photos)",
+            "suggested_deduction": number (Amount in INR, 0 if clean)
+          }}
+""")
+
 @app.post("/audit-return")
 async def audit_return(
     item_id: str = Form(...),
     images: List[UploadFile] = File(...)
 ):
-    print(f"🔄 Auditing Return for Item {item_id} with {len(images)} images...")
-
-    import httpx 
+    logger.info("🔄 Auditing Return for Item %s with %d images...", item_id, len(images))
 
     try:
         # 1. Fetch Original Item Logic
-        item_res = supabase.table("items").select("ai_reason, title, ai_status, images").eq("id", item_id).single().execute()
+        item_res = await run_query(supabase.table("items").select("ai_reason, title, ai_status, images").eq("id", item_id).single())
         if not item_res.data:
              return JSONResponse(status_code=404, content={"error": "Item not found"})
         
@@ -264,79 +933,53 @@ async def audit_return(
         original_count = 0
         
         # A. Process Original Images (Download from URL)
-        async with httpx.AsyncClient() as client:
-            for url in original_image_urls:
-                try:
-                    # Skip if invalid URL
-                    if not url or not url.startswith('http'): continue
-                    
-                    resp = await client.get(url)
-                    if resp.status_code == 200:
-                        content_type = resp.headers.get("content-type", "image/jpeg")
-                        file_parts.append({
-                            "mime_type": content_type,
-                            "data": base64.b64encode(resp.content).decode('utf-8')
-                        })
-                        original_count += 1
-                except Exception as img_err:
-                    print(f"Failed to download original image {url}: {img_err}")
+        for url in original_image_urls:
+            try:
+                # Skip if invalid URL
+                if not url or not url.startswith('http'): continue
+                
+                resp = await app.state.http.get(url)
+                if resp.status_code == 200:
+                    content_type = resp.headers.get("content-type", "image/jpeg")
+                    file_parts.append({
+                        "mime_type": content_type,
+                        "data": resp.content
+                    })
+                    original_count += 1
+            except Exception as img_err:
+                logger.warning("Failed to download original image %s: %s", url, img_err)
 
         # B. Process New Images (UploadFile)
         new_count = 0
         for file in images:
-            content = await file.read()
+            content = await read_upload(file)
             file_parts.append({
                 "mime_type": file.content_type,
-                "data": base64.b64encode(content).decode('utf-8') 
+                "data": content
             })
             new_count += 1
 
-        print(f"📸 Images prepared: {original_count} Original + {new_count} New")
+        logger.info("📸 Images prepared: %d Original + %d New", original_count, new_count)
 
         # 3. Prompt for Comparison
-        prompt_text = f"""
-          You are a Return Inspection Officer for medical equipment ranges.
-          Item: {item_title}
-          
-          CONTEXT:
-          I have provided {original_count + new_count} images total.
-          - The FIRST {original_count} images are the ORIGINAL CONDITION (Reference photos taken when listed).
-          - The LAST {new_count} images are the RETURN CONDITION (Current photos taken now).
-          
-          ORIGINAL SAFETY REPORT (Text):
-          "{original_condition}"
-          
-          TASK:
-          1. Analyze the Original Images (First {original_count}) to understand the baseline state.
-          2. Compare the Return Images (Last {new_count}) against those Original Images.
-          3. Look for NEW significant damages (cracks, water damage, broken parts) that were NOT present in the Original Images.
-          
-          Normal wear and tear (minor scratches) is acceptable.
-          
-          If successful return (no new damage), suggested_deduction should be 0.
-          If new damage found, estimate a fair deduction amount in Indian Rupees (INR) from the deposit.
-          
-          Return strictly valid JSON:
-          {{
-            "status": "clear" | "damage_reported",
-            "new_damage_found": ["string", "string"] (List specific new flaws, empty if none),
-            "analysis": "string (Short comparison summary citing specific differences between old and new photos)",
-            "suggested_deduction": number (Amount in INR, 0 if clean)
-          }}
-        """
+        prompt_text = RETURN_PROMPT.format(
+            item_title=item_title,
+            original_condition=original_condition,
+            original_count=original_count,
+            new_count=new_count,
+            total_count=original_count + new_count,
+        )
 
         # 4. Get Verdict
-        # Note: call_gemini appends images in order of file_parts list
-        result = await call_gemini(prompt_text, file_parts)
-        print("✅ Return Audit Verdict:", result)
+        # Note: Gemini sees images in order of the file_parts list
+        result = await call_gemini([prompt_text, *file_parts], ReturnVerdict)
+        logger.info("✅ Return Audit Verdict: %s", result)
         
         return result
 
     except Exception as e:
-        print("Return Audit Error:", e)
-        # Detailed logging
-        import traceback
-        traceback.print_exc()
+        # Detailed logging (includes traceback)
+        logger.exception("Return Audit Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
@@ -345,6 +988,14 @@ async def audit_return(
 # ==========================================
 
 # 1. Generate QR Code (Called by Owner or Renter depending on flow)
+# Codes issued by this process, keyed by booking id. Only this backend writes
+# handover_code, so a cached code lets a wrong scan be rejected without a DB round trip;
+# matching scans still go through the handover_scan RPC, which stays authoritative.
+# Opt-in: with several workers another process may have issued a newer code, and a stale
+# entry here would reject it, so only enable this on single-worker deployments.
+HANDOVER_FAST_REJECT = os.getenv("HANDOVER_FAST_REJECT_SINGLE_WORKER") == "1"
+HANDOVER_CODE_CACHE = TTLCache(maxsize=10_000, ttl=300)
+
 @app.post("/generate-handover")
 async def generate_handover(payload: dict = Body(...)):
     # payload expects {"bookingId": ..., "handoverType": "pickup" | "return"}
@@ -356,25 +1007,29 @@ async def generate_handover(payload: dict = Body(...)):
 
     try:
         # Create a 6-digit random code
-        secret_code = str(random.randint(100000, 999999))
+        # (secrets = CSPRNG; Mersenne Twister output is predictable from a few samples)
+        secret_code = f"{secrets.randbelow(900000) + 100000:06d}"
 
         # Save to DB
-        response = supabase.table("bookings").update({
+        response = await run_query(supabase.table("bookings").update({
             "handover_code": secret_code,
             # We might want to track what THIS code is for, but assuming single active code is enough
-        }).eq("id", booking_id).execute()
+        }).eq("id", booking_id))
         
         # Check if booking exists
         if not response.data:
             raise HTTPException(status_code=404, detail="Booking ID not found")
+
+        if HANDOVER_FAST_REJECT:
+            HANDOVER_CODE_CACHE[booking_id] = secret_code
         
-        print(f"🔐 Generated {handover_type.upper()} Code for Booking {booking_id}: {secret_code}")
+        logger.info("🔐 Generated %s Code for Booking %s: %s", handover_type.upper(), booking_id, secret_code)
         return {"qrData": secret_code}
 
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"Error generating handover: {e}")
+        logger.error("Error generating handover: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 # 2. Scan QR Code (Called by Renter or Owner depending on flow)
@@ -387,66 +1042,300 @@ async def scan_handover(payload: dict = Body(...)):
     if not booking_id:
          raise HTTPException(status_code=400, detail="Missing bookingId")
 
-    try:
-        # Fetch real code and item_id (needed for return to free up item)
-        response = supabase.table("bookings").select("handover_code, item_id").eq("id", booking_id).execute()
-        
-        if not response.data:
-            return JSONResponse(status_code=404, content={"error": "Booking not found"})
-        
-        booking = response.data[0]
-        db_code = str(booking.get("handover_code")).strip()
-        input_code = str(scanned_code).strip()
+    input_code = str(scanned_code).strip()
 
-        print(f"🔍 Verifying Handover: DB='{db_code}' vs Input='{input_code}' | Status: {booking.get('status')}")
+    if handover_type not in ('pickup', 'return'):
+        raise HTTPException(status_code=400, detail="Invalid handoverType")
 
-        # Validate
-        if str(booking.get("handover_code")) == str(scanned_code):
-            
-            updates = {"handover_code": None}
-            
-            if handover_type == 'pickup':
-                updates["status"] = "in_use"
-                message = "Rental Started! Handover Complete."
-            
-            elif handover_type == 'return':
-                updates["status"] = "returned"
-                # Make item available again
-                supabase.table("items").update({"is_available": True}).eq("id", booking["item_id"]).execute()
-                message = "Return Successful! Item is now available."
-            
-            # Update Booking
-            supabase.table("bookings").update(updates).eq("id", booking_id).execute()
+    cached_code = HANDOVER_CODE_CACHE.get(booking_id) if HANDOVER_FAST_REJECT else None
+    if cached_code is not None and cached_code != input_code:
+        logger.info("❌ Invalid Code for Booking %s: Input=%s", booking_id, input_code)
+        return JSONResponse(
+            status_code=400, 
+            content={"success": False, "message": "Invalid QR Code"}
+        )
 
-            print(f"🔓 {handover_type.upper()} Handover Successful for Booking {booking_id}")
-            return {"success": True, "message": message}
-        else:
-            print(f"❌ Invalid Code: DB={db_code} vs Input={input_code}")
-            return JSONResponse(
-                status_code=400, 
-                content={"success": False, "message": "Invalid QR Code"}
-            )
+    try:
+        # Validate + consume the code + free the item (on return) in one atomic RPC
+        # (see sql/handover_scan.sql)
+        response = await run_query(supabase.rpc("handover_scan", {
+            "bid": booking_id,
+            "code": input_code,
+            "htype": handover_type,
+        }))
+        result = response.data or {}
+
+        if result.get("success"):
+            HANDOVER_CODE_CACHE.pop(booking_id, None)  # the RPC cleared the code
+            logger.info("🔓 %s Handover Successful for Booking %s", handover_type.upper(), booking_id)
+            return {"success": True, "message": result["message"]}
+
+        if result.get("error") == "not_found":
+            return JSONResponse(status_code=404, content={"error": "Booking not found"})
+
+        logger.info("❌ Invalid Code for Booking %s: Input=%s", booking_id, input_code)
+        return JSONResponse(
+            status_code=400, 
+            content={"success": False, "message": "Invalid QR Code"}
+        )
 
     except Exception as e:
-        print(f"❌ Scan Handover Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Scan Handover Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
 # ==========================================
 #  FEATURE 4: CREATE LISTING (Supabase)
 # ==========================================
+
+# Cover image for listings created without photos ('items.image_url' is a required text field)
+PLACEHOLDER_IMAGE_URL = "https://images.unsplash.com/photo-1584515933487-779824d29309?w=800&auto=format&fit=crop"
+
+# Row shape for the 'items' table; validating up front means bad form input (e.g. a
+# non-numeric price) fails before any DB round trip or storage upload.
+class ItemCreate(BaseModel):
+    model_config = {"extra": "forbid"}
+
+    id: str
+    owner_id: str
+    title: str
+    category: str
+    description: str
+    price_per_day: float = 0
+    deposit_amount: float = 0
+    address_text: str
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    image_url: str
+    thumb_url: Optional[str] = None # Small cover for grid/cards
+    ai_status: str
+    ai_reason: str
+    is_available: bool = True
+    contact_email: Optional[str] = None
+    contact_phone: Optional[str] = None
+    images: List[str] = []
+
+# --- HELPER: Time-ordered item ids (UUIDv7, RFC 9562) ---
+# Random v4 ids scatter inserts across the items primary-key B-tree; v7 ids start with a
+# millisecond timestamp, so new rows append to its right-hand edge.
+def uuid7() -> str:
+    if hasattr(uuid, "uuid7"):  # Python 3.14+
+        return str(uuid.uuid7())
+    unix_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (unix_ms & 0xFFFF_FFFF_FFFF) << 80   # 48-bit timestamp
+    value |= 0x7 << 76                            # version 7
+    value |= (rand >> 68) << 64                   # 12 random bits
+    value |= 0b10 << 62                           # RFC 4122 variant
+    value |= rand & ((1 << 62) - 1)               # 62 random bits
+    return str(uuid.UUID(int=value))
+
+# Images of ONE listing processed (resized + full/thumb uploaded) at a time. The limit is
+# created per call, so concurrent listings don't queue behind each other's uploads.
+LISTING_IMAGE_CONCURRENCY = 4
+
+async def gather_limited(aws, limit: int, return_exceptions: bool = False) -> list:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+# --- HELPER: Upload one object to Supabase Storage (device-images bucket) ---
+# Direct REST call through the shared async client; returns the object's public URL.
+async def upload_storage_object(file_path: str, content: bytes, content_type: str) -> str:
+    headers = {
+        "Authorization": f"Bearer {supabase_key}",
+        "apikey": supabase_key,
+        "Content-Type": content_type or "application/octet-stream",
+        "x-upsert": "true",
+    }
+
+    resp = await app.state.http.post(
+        f"{STORAGE_OBJECT_URL}device-images/{quote(file_path)}",
+        content=content,
+        headers=headers,
+    )
+    resp.raise_for_status()
+
+    return PUBLIC_BUCKET_PREFIX + quote(file_path)
+
+# --- HELPER: Store one listing image as a full-size + thumbnail pair ---
+async def store_listing_image(item_id: str, idx: int, filename: str, content: bytes, content_type: str) -> tuple:
+    # Naming: {item_id}/{idx}-{stem}.jpg, thumbnails under {item_id}/thumbs/. The index keeps
+    # e.g. front.png and front.jpg from landing on (and upserting over) the same object.
+    name = Path(filename or "image").name
+    stem = f"{idx}-{Path(name).stem}"
+    try:
+        # One pool task decodes the image once for both sizes
+        full, thumb = await run_in_resize_pool(resize_variants, content, (LISTING_IMAGE_EDGE, THUMB_IMAGE_EDGE))
+    except UNDECODABLE_IMAGE_ERRORS as resize_err:
+        # Not decodable locally: store the original as-is and reuse it as its own thumbnail
+        logger.warning("Could not resize %s: %s", name, resize_err)
+        url = await upload_storage_object(f"{item_id}/{idx}-{name}", content, content_type)
+        return url, url
+
+    return await asyncio.gather(
+        upload_storage_object(f"{item_id}/{stem}.jpg", full, "image/jpeg"),
+        upload_storage_object(f"{item_id}/thumbs/{stem}.jpg", thumb, "image/jpeg"),
+    )
+
+async def upload_listing_image(item_id: str, idx: int, file: UploadFile) -> tuple:
+    content = await read_upload(file)
+    return await store_listing_image(item_id, idx, file.filename, content, file.content_type)
+
+# --- HELPER: Upload all listing images, returning (full_url, thumb_url) pairs that succeeded ---
+async def upload_all_images(item_id: str, images: List[UploadFile]) -> list:
+    if not images:
+        return []
+
+    logger.info("📤 Uploading %d images for item %s...", len(images), item_id)
+    results = await gather_limited(
+        (upload_listing_image(item_id, idx, file) for idx, file in enumerate(images)),
+        LISTING_IMAGE_CONCURRENCY,
+        return_exceptions=True
+    )
+
+    for err in (r for r in results if isinstance(r, BaseException)):
+        logger.warning("⚠️ Storage Upload Error: %s", err)
+        # We proceed without failing
+
+    # gather preserves input order, so the first successful upload is the cover image
+    return [r for r in results if not isinstance(r, BaseException)]
+
+# --- HELPER: Bind an item_id + its object paths to this server ---
+# /create-listing must only accept an item_id (used as the storage prefix) that /create-listing/sign
+# issued, otherwise a client could name an existing listing's folder. The grant is an
+# HMAC over (item_id, expiry, paths) so any worker sharing the secret can verify it.
+LISTING_UPLOAD_SECRET = (os.getenv("LISTING_UPLOAD_SECRET") or SUPABASE_SERVICE_ROLE_KEY or secrets.token_hex(32)).encode()
+UPLOAD_GRANT_TTL = 2 * 60 * 60  # Supabase signed upload URLs are valid for 2h
+
+def sign_upload_grant(item_id: str, paths: List[str], expires: int) -> str:
+    message = "\n".join([item_id, str(expires), *paths]).encode()
+    return hmac.new(LISTING_UPLOAD_SECRET, message, hashlib.sha256).hexdigest()
+
+def verify_upload_grant(item_id: str, paths: List[str], grant: str) -> bool:
+    expires, _, signature = (grant or "").partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, sign_upload_grant(item_id, paths, int(expires)))
+
+# --- Sweep originals whose listing was never created ---
+# /create-listing/sign needs no session, so abandoned (or abusive) signed uploads would sit in
+# the public bucket forever. Once their grant has expired they can never be ingested, so
+# anything past that (plus slack for an ingest already underway) is removed.
+ORIGINALS_MAX_AGE = UPLOAD_GRANT_TTL + 15 * 60
+ORIGINALS_SWEEP_SECONDS = 30 * 60
+
+async def sweep_stale_originals():
+    """Periodically delete expired {item_id}/originals/ objects (see sql/stale_upload_originals.sql)."""
+    while True:
+        try:
+            res = await run_query(supabase.rpc("stale_upload_originals", {"max_age_seconds": ORIGINALS_MAX_AGE}))
+            paths = [row["name"] for row in res.data or []]
+            if paths:
+                await asyncio.to_thread(supabase.storage.from_("device-images").remove, paths)
+                logger.info("🧹 Removed %d stale upload originals", len(paths))
+        except Exception as e:
+            logger.warning("⚠️ Could not sweep stale upload originals: %s", e)
+        await asyncio.sleep(ORIGINALS_SWEEP_SECONDS)
+
+# --- HELPER: Pull a browser-uploaded original back for validation ---
+# Signed uploads bypass check_image_uploads, so the same size + magic-byte checks run here,
+# reading over the pooled connection and giving up as soon as the size cap is passed.
+async def fetch_direct_upload(path: str) -> bytes:
+    headers = {"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key}
+    buffer = bytearray()
+    async with app.state.http.stream("GET", f"{STORAGE_OBJECT_URL}device-images/{quote(path)}", headers=headers) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes(UPLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > MAX_IMAGE_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"'{Path(path).name}' exceeds the {MAX_IMAGE_BYTES // (1024 * 1024)}MB image limit."
+                )
+    if not is_image_signature(bytes(buffer[:12])):
+        raise HTTPException(status_code=415, detail=f"'{Path(path).name}' is not a JPEG, PNG, WebP, GIF or HEIC image.")
+    return bytes(buffer)
+
+# --- HELPER: Validate + resize direct uploads into the same layout as multipart ones ---
+# Originals land under {item_id}/originals/ and are always removed afterwards, so only
+# validated, resized images (plus thumbnails) stay in the public bucket.
+async def ingest_direct_uploads(item_id: str, paths: List[str]) -> list:
+    try:
+        contents = await gather_limited((fetch_direct_upload(path) for path in paths), LISTING_IMAGE_CONCURRENCY)
+        return await gather_limited(
+            (
+                # Signed names are "{idx}-{original name}"; the type comes from the bytes, so an
+                # unresizable HEIC original is still stored as image/heic, not octet-stream
+                store_listing_image(item_id, idx, Path(path).name.partition("-")[2], content, sniff_image_type(content[:12]))
+                for idx, (path, content) in enumerate(zip(paths, contents))
+            ),
+            LISTING_IMAGE_CONCURRENCY,
+        )
+    finally:
+        try:
+            await asyncio.to_thread(supabase.storage.from_("device-images").remove, paths)
+        except Exception as cleanup_err:
+            logger.warning("Could not remove uploaded originals for %s: %s", item_id, cleanup_err)
+
+# Direct-to-Storage uploads: the browser asks for signed upload URLs, PUTs each image
+# straight to Supabase Storage, then calls /create-listing with just the object paths.
+# The slow client uplink skips this server; create-listing then pulls the originals over
+# the pooled server-side connection to validate, resize and thumbnail them.
+@app.post("/create-listing/sign")
+async def sign_listing_uploads(payload: dict = Body(...)):
+    # payload expects {"filenames": ["front.jpg", ...]}
+    filenames = payload.get("filenames") or []
+    if not filenames or not all(isinstance(name, str) for name in filenames):
+        return JSONResponse(status_code=400, content={"error": "Missing filenames"})
+    if len(filenames) > MAX_IMAGES_PER_REQUEST:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"Upload at most {MAX_IMAGES_PER_REQUEST} images per request."}
+        )
+
+    item_id = uuid7()
+    # Path(...).name drops any directory components a client might sneak in
+    paths = [f"{item_id}/originals/{idx}-{Path(name).name}" for idx, name in enumerate(filenames)]
+
+    try:
+        signed = await asyncio.gather(*(
+            asyncio.to_thread(supabase.storage.from_("device-images").create_signed_upload_url, path)
+            for path in paths
+        ))
+        expires = int(time.time()) + UPLOAD_GRANT_TTL
+        return {
+            "itemId": item_id,
+            # Echo back to /create-listing (as upload_grant) to prove item_id came from here
+            "uploadGrant": f"{expires}.{sign_upload_grant(item_id, paths, expires)}",
+            "uploads": [
+                {
+                    "path": path,
+                    "token": res["token"],
+                    "signedUrl": res.get("signed_url") or res.get("signedUrl"),
+                }
+                for path, res in zip(paths, signed)
+            ],
+        }
+    except Exception as e:
+        logger.error("❌ Signed Upload Error: %s", e)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 @app.post("/create-listing")
 async def create_listing(
     title: str = Form(...),
     category: str = Form(...),
     description: str = Form(...),
-    price: str = Form(...),
-    deposit: str = Form("0"), # New Field: Deposit Amount
+    # Numeric fields are coerced/validated by FastAPI before the handler runs
+    price: float = Form(...),
+    deposit: float = Form(0), # New Field: Deposit Amount
     location: str = Form(...),
-    lat: Optional[str] = Form(None),
-    lng: Optional[str] = Form(None),
+    lat: Optional[float] = Form(None),
+    lng: Optional[float] = Form(None),
     verified: bool = Form(...),
     safety_score: int = Form(...),
     owner_id: str = Form(...),
@@ -456,130 +1345,106 @@ async def create_listing(
     user_name: Optional[str] = Form(None),
     reason: Optional[str] = Form(None),
     flaws_found: Optional[str] = Form(None),
+    # Either direct-uploaded object paths (JSON list) + the item_id and grant that
+    # /create-listing/sign issued for them...
+    item_id: Optional[str] = Form(None),
+    image_paths: Optional[str] = Form(None),
+    upload_grant: Optional[str] = Form(None),
+    # ...or legacy multipart image files
     images: List[UploadFile] = File(default=[])
 ):
-    print(f"📝 Creating Item in 'items' table: {title} @ ({lat}, {lng}) Owner: {owner_id}")
+    logger.info("📝 Creating Item in 'items' table: %s @ (%s, %s) Owner: %s", title, lat, lng, owner_id)
     
+    # 1. Owner ID is now passed from Frontend (Supabase Auth ID)
+    if not owner_id:
+        return JSONResponse(status_code=400, content={"error": "Missing owner_id"})
+
+    # Same header-only pre-check as /audit-item, before any image body is read
+    invalid = check_image_uploads(images)
+    if invalid:
+        return invalid
+
+    # 2. Prepare + validate data for 'items' schema (before touching the DB)
+    # The id is generated here (not by the DB) so image uploads, which use it as their
+    # storage path prefix, can run before the row exists. A client-supplied item_id is
+    # only honoured together with the paths and grant /create-listing/sign issued for it.
+    direct_paths = []
+    if item_id or image_paths or upload_grant:
+        if images:
+            return JSONResponse(status_code=400, content={"error": "Send either image_paths or images, not both"})
+        try:
+            direct_paths = orjson.loads(image_paths or "null")
+        except orjson.JSONDecodeError:
+            return JSONResponse(status_code=400, content={"error": "Invalid image_paths"})
+        if not (item_id and isinstance(direct_paths, list) and all(isinstance(p, str) for p in direct_paths)
+                and verify_upload_grant(item_id, direct_paths, upload_grant)):
+            return JSONResponse(
+                status_code=403,
+                content={"error": "item_id/image_paths were not issued by /create-listing/sign"}
+            )
+        new_item_id = item_id
+    else:
+        new_item_id = uuid7()
+
+    ai_status = "verified" if verified else "pending"
+    ai_full_reason = f"Score: {safety_score}/10. {reason or ''}"
+    if flaws_found:
+         ai_full_reason += f" Flaws: {flaws_found}"
+
     try:
-        # 1. Owner ID is now passed from Frontend (Supabase Auth ID)
-        if not owner_id:
-            raise HTTPException(status_code=400, detail="Missing owner_id")
-
-        # --- FIX: Ensure Profile Exists (Foreign Key Constraint) ---
-        # The public.profiles table might not have this user if no trigger is set up.
-        # We manually upsert the profile to valid the FK in 'items'.
-        if user_email: # Only try to sync profile if we have data
-            try:
-                profile_data = {
-                    "id": owner_id,
-                    # "email": user_email, # REMOVED: Schema does not have email column
-                    # "full_name": user_name or "User", 
-                }
-                
-                # Using upsert is safer
-                supabase.table("profiles").upsert(profile_data).execute()
-                print(f"👤 Profile synced for {owner_id}")
-            except Exception as pe:
-                print(f"⚠️ Warning syncing profile: {pe}")
-                # We continue, hoping the profile exists or the error was benign.
-                # If strictly FK fails, the next step will catch it.
-
-        # 2. Prepare Data for 'items' schema
-        ai_status = "verified" if verified else "pending"
-        ai_full_reason = f"Score: {safety_score}/10. {reason or ''}"
-        if flaws_found:
-             ai_full_reason += f" Flaws: {flaws_found}"
-        
-        # Image Handling: Use a placeholder since we don't have storage buckets set up 
-        # and 'items' expects a single 'image_url' text field.
-        # In a real app, we would upload the file to Supabase Storage and get the URL.
-        final_image_url = "https://images.unsplash.com/photo-1584515933487-779824d29309?w=800&auto=format&fit=crop"
-
-        item_data = {
-            "owner_id": owner_id,
-            "title": title,
-            "category": category,
-            "description": description,
-            "price_per_day": float(price) if price else 0,
-            "deposit_amount": float(deposit) if deposit else 0, # New Field
-            "address_text": location,
-            "lat": float(lat) if lat else None,
-            "lng": float(lng) if lng else None,
-            "image_url": final_image_url,
-            "ai_status": ai_status,
-            "ai_reason": ai_full_reason,
-            "ai_reason": ai_full_reason,
-            "is_available": True,
+        item_data = ItemCreate(
+            id=new_item_id,
+            owner_id=owner_id,
+            title=title,
+            category=category,
+            description=description,
+            price_per_day=price,
+            deposit_amount=deposit, # New Field
+            address_text=location,
+            lat=lat,
+            lng=lng,
+            image_url=PLACEHOLDER_IMAGE_URL, # Replaced below once images are uploaded
+            ai_status=ai_status,
+            ai_reason=ai_full_reason,
             # We try to save contact info if columns exist
             # Note: User reported DB columns have typos: 'contect_email' and 'contect_phone'
-            "contact_email": contact_email,
-            "contact_phone": contact_phone,
-            "images": []
-        }
+            contact_email=contact_email,
+            contact_phone=contact_phone,
+        ).model_dump(exclude_none=True)
+    except ValidationError as ve:
+        return JSONResponse(status_code=400, content={"error": "Invalid listing data", "details": ve.errors(include_url=False)})
 
-        # 3. Insert
-        # If schema is missing columns, we might need to be dynamic, but FastAPI/Pydantic/Supabase usually want strictness.
-        # We'll proceed assuming columns exist as per user request.
-        response = supabase.table("items").insert(item_data).execute()
+    try:
+        # 3. Upload images before touching 'items', so the row can be written once with
+        #    its final URLs instead of INSERT + UPDATE.
+        if direct_paths:
+            try:
+                uploaded = await ingest_direct_uploads(new_item_id, direct_paths)
+            except HTTPException as he:
+                return JSONResponse(status_code=he.status_code, content={"error": he.detail})
+        else:
+            uploaded = await upload_all_images(new_item_id, images)
+        if uploaded:
+            item_data["images"] = [full for full, _ in uploaded]
+            item_data["image_url"], item_data["thumb_url"] = uploaded[0]
+
+        # 4. Ensure the owner's profile (FK target) + insert the item in one transaction
+        #    (see sql/create_listing_txn.sql). The public.profiles table might not have
+        #    this user if no trigger is set up.
+        response = await run_query(supabase.rpc("create_listing_txn", {
+            "p_owner": owner_id,
+            "p_item": item_data,
+        }))
         
         if not response.data:
              raise HTTPException(status_code=500, detail="Failed to create item in Database")
 
-        new_item = response.data[0]
-        new_item_id = new_item.get('id')
-        print(f"✅ DB Item Created: {new_item_id}")
-
-        # 4. Upload Images to Supabase Storage (device-images bucket)
-        uploaded_image_url = None
-        all_image_urls = []
-        
-        if images:
-            print(f"📤 Uploading {len(images)} images for item {new_item_id}...")
-            try:
-                for idx, file in enumerate(images):
-                    # Reset file cursor just in case it was read before
-                    await file.seek(0)
-                    file_content = await file.read()
-                    
-                    # Naming: {item_id}/{original_filename}
-                    file_path = f"{new_item_id}/{file.filename}"
-                    
-                    # Upload to Supabase Storage
-                    storage_res = supabase.storage.from_("device-images").upload(
-                        path=file_path,
-                        file=file_content,
-                        file_options={"content-type": file.content_type, "x-upsert": "true"}
-                    )
-                    
-                    # Get Public URL
-                    public_url_resp = supabase.storage.from_("device-images").get_public_url(file_path)
-                    
-                    # Add to list
-                    all_image_urls.append(public_url_resp)
-
-                    if idx == 0:
-                        uploaded_image_url = public_url_resp
-            
-            except Exception as storage_err:
-                print(f"⚠️ Storage Upload Error: {storage_err}")
-                # We proceed without failing
-        
-        # 5. Update 'image_url' and 'images' array in DB
-        if uploaded_image_url:
-            print(f"🖼️ Updating Item Image URLs...")
-            update_payload = {
-                "image_url": uploaded_image_url,
-                "images": all_image_urls 
-            }
-            supabase.table("items").update(update_payload).eq("id", new_item_id).execute()
-            new_item['image_url'] = uploaded_image_url
-            new_item['images'] = all_image_urls
-
-        print(f"✅ Listing Complete ID: {new_item_id}")
+        new_item = response.data
+        logger.info("✅ Listing Complete ID: %s", new_item_id)
         return {"success": True, "item": new_item}
 
     except Exception as e:
-        print(f"❌ Error creating item: {e}")
+        logger.error("❌ Error creating item: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
@@ -587,6 +1452,13 @@ async def create_listing(
 #  FEATURE 5: REVIEWS & RATINGS (Supabase)
 # ==========================================
 
+# Short-lived read caches: listing cards fan out to many profile/review reads, and a
+# 30s staleness window is fine for ratings. create_review evicts the affected keys.
+REVIEW_CACHE_TTL = 30
+profile_cache = TTLCache(maxsize=10_000, ttl=REVIEW_CACHE_TTL)
+item_reviews_cache = TTLCache(maxsize=10_000, ttl=REVIEW_CACHE_TTL)
+owner_reviews_cache = TTLCache(maxsize=10_000, ttl=REVIEW_CACHE_TTL)
+
 @app.post("/reviews")
 async def create_review(
     booking_id: str = Body(...),
@@ -596,7 +1468,7 @@ async def create_review(
 ):
     try:
         # 1. Verify Booking exists
-        booking_res = supabase.table("bookings").select("*").eq("id", booking_id).execute()
+        booking_res = await run_query(supabase.table("bookings").select("*").eq("id", booking_id))
         if not booking_res.data:
             raise HTTPException(status_code=404, detail="Booking not found")
         
@@ -616,66 +1488,89 @@ async def create_review(
             "owner_id": owner_id
         }
         
-        res = supabase.table("reviews").insert(data).execute()
+        res = await run_query(supabase.table("reviews").insert(data))
         
         if not res.data:
              raise HTTPException(status_code=500, detail="Failed to save review")
+
+        # New review changes the owner's rating and both review lists
+        profile_cache.pop(owner_id, None)
+        owner_reviews_cache.pop(owner_id, None)
+        item_reviews_cache.pop(item_id, None)
              
         return {"success": True, "review": res.data[0]}
 
     except Exception as e:
-        print(f"Review Error: {e}")
+        logger.error("Review Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/reviews/item/{item_id}")
 async def get_item_reviews(item_id: str):
+    # Single lookup: a TTL entry can expire between an `in` check and the read
+    cached = item_reviews_cache.get(item_id)
+    if cached is not None:
+        return cached
+
     try:
         # Fetch reviews with reviewer details
         # Note: Supabase-py syntax for foreign table join is usually select("*, profiles(*)")
         # Assuming foreign keys are set up correctly: reviews.reviewer_id -> profiles.id
-        res = supabase.table("reviews").select("*, profiles:reviewer_id(full_name, avatar_url)").eq("item_id", item_id).order("created_at", desc=True).execute()
+        res = await run_query(supabase.table("reviews").select("*, profiles:reviewer_id(full_name, avatar_url)").eq("item_id", item_id).order("created_at", desc=True))
+        item_reviews_cache[item_id] = res.data
         return res.data
     except Exception as e:
-        print(f"Get Item Reviews Error: {e}")
+        logger.error("Get Item Reviews Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/reviews/owner/{owner_id}")
 async def get_owner_reviews(owner_id: str):
+    # Single lookup: a TTL entry can expire between an `in` check and the read
+    cached = owner_reviews_cache.get(owner_id)
+    if cached is not None:
+        return cached
+
     try:
         # Fetch reviews for all items owned by this user
-        res = supabase.table("reviews").select("*, profiles:reviewer_id(full_name, avatar_url), items(title)").eq("owner_id", owner_id).order("created_at", desc=True).execute()
+        res = await run_query(supabase.table("reviews").select("*, profiles:reviewer_id(full_name, avatar_url), items(title)").eq("owner_id", owner_id).order("created_at", desc=True))
+        owner_reviews_cache[owner_id] = res.data
         return res.data
     except Exception as e:
-        print(f"Get Owner Reviews Error: {e}")
+        logger.error("Get Owner Reviews Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 @app.get("/profile/{user_id}")
 async def get_public_profile(user_id: str):
+    # Single lookup: a TTL entry can expire between an `in` check and the read
+    cached = profile_cache.get(user_id)
+    if cached is not None:
+        return cached
+
     try:
-        # 1. Get Profile Info
-        profile_res = supabase.table("profiles").select("*").eq("id", user_id).single().execute()
+        # 1. Get Profile Info + Aggregated Rating in one round trip (PostgREST embedded
+        #    aggregate over the owner's reviews; see sql/enable_postgrest_aggregates.sql)
+        profile_res = await run_query(
+            supabase.table("profiles")
+            .select("*, reviews!owner_id(rating.avg(), count())")
+            .eq("id", user_id)
+            .single()
+        )
         if not profile_res.data:
             raise HTTPException(status_code=404, detail="User not found")
             
         profile = profile_res.data
+        rating_rows = profile.pop("reviews", None) or [{}]
+        stats = rating_rows[0]
         
-        # 2. Get Aggregated Rating
-        # Supabase-py doesn't have easy AVG helper yet without stored procedure/RPC. 
-        # We will fetch all ratings (lightweight) and calc avg in python for now, or use RPC if user prefers.
-        # Python approach is easier for prototype.
-        reviews_res = supabase.table("reviews").select("rating").eq("owner_id", user_id).execute()
-        
-        ratings = [r['rating'] for r in reviews_res.data]
-        avg_rating = sum(ratings) / len(ratings) if ratings else 0.0
-        
-        return {
+        result = {
             "profile": profile,
-            "rating": round(avg_rating, 1),
-            "total_reviews": len(ratings)
+            "rating": round(float(stats.get("avg") or 0), 1),
+            "total_reviews": stats.get("count") or 0
         }
+        profile_cache[user_id] = result
+        return result
         
     except Exception as e:
-         print(f"Profile Error: {e}")
+         logger.error("Profile Error: %s", e)
          return JSONResponse(status_code=500, content={"error": str(e)})
 
 
@@ -690,15 +1585,15 @@ async def chat_ai(payload: dict = Body(...)):
     if not message:
         raise HTTPException(status_code=400, detail="Message is required")
 
-    print(f"🤖 AI Chat Query: {message} | Context: {context.get('device_name', 'None')}")
+    logger.info("🤖 AI Chat Query: %s | Context: %s", message, context.get('device_name', 'None'))
     
     try:
         # Delegate to Agno Agent
-        response = get_agent_response(message, context)
+        response = await get_agent_response_async(message, context)
         return {"response": response}
 
     except Exception as e:
-        print(f"AI Agent Error: {e}")
+        logger.error("AI Agent Error: %s", e)
         return JSONResponse(status_code=500, content={"error": "AI Service Unavailable"})
 
 
@@ -714,7 +1609,7 @@ async def complete_booking(payload: dict = Body(...)):
     try:
         # 1. Fetch Booking and Item details
         # We need the item price for penalty calculation
-        booking_res = supabase.table("bookings").select("*, items(*)").eq("id", booking_id).single().execute()
+        booking_res = await run_query(supabase.table("bookings").select("*, items(*)").eq("id", booking_id).single())
         if not booking_res.data:
             raise HTTPException(status_code=404, detail="Booking not found")
         
@@ -745,7 +1640,7 @@ async def complete_booking(payload: dict = Body(...)):
                 penalty_amount = overdue_days * price_per_day * 2
                 
                 overdue_message = f"Return is {overdue_days} days late. Penalty: ₹{penalty_amount} applied."
-                print(f"⚠️ Booking {booking_id} Overdue! Penalty: {penalty_amount}")
+                logger.warning("⚠️ Booking %s Overdue! Penalty: %s", booking_id, penalty_amount)
 
         # 3. Update Booking Status
         # We could save penalty_amount to a new column if it existed.
@@ -761,12 +1656,13 @@ async def complete_booking(payload: dict = Body(...)):
         
         # If we had a penalty column: update_data["penalty"] = penalty_amount
         
-        supabase.table("bookings").update(update_data).eq("id", booking_id).execute()
-
-        # 4. Mark Item as Available
-        supabase.table("items").update({"is_available": True}).eq("id", item.get("id")).execute()
+        # 4. Mark Item as Available (independent of the booking update, so run both at once)
+        await asyncio.gather(
+            run_query(supabase.table("bookings").update(update_data).eq("id", booking_id)),
+            run_query(supabase.table("items").update({"is_available": True}).eq("id", item.get("id"))),
+        )
         
-        print(f"✅ Booking {booking_id} Completed. Item {item.get('id')} is now Available.")
+        logger.info("✅ Booking %s Completed. Item %s is now Available.", booking_id, item.get('id'))
 
         return {
             "success": True,
@@ -776,7 +1672,7 @@ async def complete_booking(payload: dict = Body(...)):
         }
 
     except Exception as e:
-        print(f"Complete Booking Error: {e}")
+        logger.error("Complete Booking Error: %s", e)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
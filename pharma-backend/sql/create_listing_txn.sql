@@ -0,0 +1,36 @@
+-- Ensures the owner's profile row exists (FK target) and inserts the listing in one
+-- transaction / one round trip. Called from POST /create-listing via supabase.rpc.
+create or replace function public.create_listing_txn(p_owner uuid, p_item jsonb)
+returns items
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_item items;
+begin
+  insert into profiles (id) values (p_owner) on conflict (id) do nothing;
+
+  -- Only the listed columns are written: any of them missing from p_item is inserted as
+  -- NULL (is_available falls back to true); unlisted columns (e.g. created_at) keep their
+  -- table defaults.
+  insert into items (
+    id, owner_id, title, category, description, price_per_day, deposit_amount,
+    address_text, lat, lng, image_url, thumb_url, ai_status, ai_reason,
+    is_available, contact_email, contact_phone, images
+  )
+  select
+    r.id, p_owner, r.title, r.category, r.description, r.price_per_day, r.deposit_amount,
+    r.address_text, r.lat, r.lng, r.image_url, r.thumb_url, r.ai_status, r.ai_reason,
+    coalesce(r.is_available, true), r.contact_email, r.contact_phone, r.images
+  from jsonb_populate_record(null::items, p_item) as r
+  returning * into v_item;
+
+  return v_item;
+end;
+$$;
+
+-- security definer bypasses RLS, so it must not be reachable through PostgREST with the
+-- public anon key (or a user JWT); only the backend's service-role key may call it.
+revoke execute on function public.create_listing_txn(uuid, jsonb) from public, anon, authenticated;
+grant execute on function public.create_listing_txn(uuid, jsonb) to service_role;
@@ -0,0 +1,4 @@
+-- PostgREST aggregate functions (avg(), count(), ...) are off by default. /profile/{user_id}
+-- embeds `reviews!owner_id(rating.avg(), count())` in its profile select, which needs them.
+alter role authenticator set pgrst.db_aggregates_enabled = 'true';
+notify pgrst, 'reload config';
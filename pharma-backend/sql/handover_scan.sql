@@ -0,0 +1,48 @@
+-- Validates a scanned handover code and applies the resulting booking/item status change
+-- in a single transaction. Called from POST /scan-handover via supabase.rpc("handover_scan").
+create or replace function public.handover_scan(bid uuid, code text, htype text)
+returns json
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+  v_item_id uuid;
+begin
+  if htype not in ('pickup', 'return') then
+    return json_build_object('success', false, 'error', 'invalid_type', 'message', 'Invalid handoverType');
+  end if;
+
+  -- Only matches when the stored code equals the scanned one (no SELECT-then-UPDATE window)
+  update bookings
+     set handover_code = null,
+         status = case when htype = 'pickup' then 'in_use' else 'returned' end
+   where id = bid
+     and handover_code::text = code
+  returning item_id into v_item_id;
+
+  if not found then
+    if not exists (select 1 from bookings where id = bid) then
+      return json_build_object('success', false, 'error', 'not_found', 'message', 'Booking not found');
+    end if;
+    return json_build_object('success', false, 'error', 'invalid_code', 'message', 'Invalid QR Code');
+  end if;
+
+  if htype = 'return' then
+    -- Make item available again
+    update items set is_available = true where id = v_item_id;
+  end if;
+
+  return json_build_object(
+    'success', true,
+    'message', case when htype = 'pickup'
+                    then 'Rental Started! Handover Complete.'
+                    else 'Return Successful! Item is now available.' end
+  );
+end;
+$$;
+
+-- security definer: keep it off the anon/authenticated PostgREST surface, otherwise it is an
+-- unthrottled 6-digit code oracle that sidesteps the backend. Only the backend calls it.
+revoke execute on function public.handover_scan(uuid, text, text) from public, anon, authenticated;
+grant execute on function public.handover_scan(uuid, text, text) to service_role;
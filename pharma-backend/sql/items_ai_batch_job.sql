@@ -0,0 +1,3 @@
+-- Tracks the Gemini Batch Mode job a listing is queued in (see /audit-item-batch).
+-- Cleared once the verdict has been written back.
+alter table public.items add column if not exists ai_batch_job text;
@@ -0,0 +1,2 @@
+-- 400px cover thumbnail written by /create-listing, used by listing grids/cards.
+alter table public.items add column if not exists thumb_url text;
@@ -0,0 +1,23 @@
+-- Lists browser-uploaded originals (device-images/{item_id}/originals/...) older than
+-- max_age_seconds, i.e. signed uploads whose /create-listing never came. storage.objects
+-- isn't exposed over PostgREST, so the backend's sweep calls this via
+-- supabase.rpc("stale_upload_originals") and removes the returned paths.
+create or replace function public.stale_upload_originals(max_age_seconds integer, max_rows integer default 1000)
+returns table (name text)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+  select o.name
+    from storage.objects o
+   where o.bucket_id = 'device-images'
+     and o.name like '%/originals/%'
+     and o.created_at < now() - make_interval(secs => max_age_seconds)
+   order by o.created_at
+   limit max_rows;
+$$;
+
+-- security definer over storage.objects: only the backend (service role) may list these.
+revoke execute on function public.stale_upload_originals(integer, integer) from public, anon, authenticated;
+grant execute on function public.stale_upload_originals(integer, integer) to service_role;
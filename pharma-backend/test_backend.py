@@ -1,34 +1,35 @@
-import urllib.request
-import json
+import httpx
 import base64
 import time
 
 BASE_URL = "http://localhost:3000"
 
+# One keep-alive client for every call, so repeated/looped requests skip the TCP handshake
+client = httpx.Client(base_url=BASE_URL, timeout=30)
+
+# 1x1 white pixel PNG (decoded once, not per call)
+DUMMY_PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP6DwABBAEKKfv5jAAAAABJRU5ErkJggg==")
+
 def test_generate_handover():
     import uuid
     dummy_uuid = str(uuid.uuid4())
     print(f"Testing /generate-handover with UUID: {dummy_uuid}...")
-    url = f"{BASE_URL}/generate-handover"
-    data = json.dumps({"bookingId": dummy_uuid}).encode('utf-8')
-    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
     
     try:
-        with urllib.request.urlopen(req) as response:
-            print(f"Status: {response.status}")
-            print(f"Response: {response.read().decode('utf-8')}")
-    except urllib.error.HTTPError as e:
-        print(f"Error: {e.code} - {e.read().decode('utf-8')}")
+        response = client.post("/generate-handover", json={"bookingId": dummy_uuid})
+        if response.is_error:
+            print(f"Error: {response.status_code} - {response.text}")
+        else:
+            print(f"Status: {response.status_code}")
+            print(f"Response: {response.text}")
     except Exception as e:
         print(f"Failed: {e}")
 
 def create_dummy_image():
-    # 1x1 white pixel PNG
-    return base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP6DwABBAEKKfv5jAAAAABJRU5ErkJggg==")
+    return DUMMY_PNG
 
 def test_audit_item():
     print("\nTesting /audit-item...")
-    url = f"{BASE_URL}/audit-item"
     boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
     
     # Construct multipart form data manually (since we want to avoid 'requests' dep if possible)
@@ -49,3 +50,4 @@ if __name__ == "__main__":
     # Wait for server to start
     time.sleep(2) 
     test_generate_handover()
+    client.close()
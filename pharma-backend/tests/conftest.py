@@ -0,0 +1,15 @@
+import base64
+import os
+import sys
+
+# main.py builds its clients at import time; give it harmless placeholder config so the
+# app can be imported without a .env (nothing here talks to Supabase or Gemini).
+os.environ.setdefault("VITE_SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("VITE_SUPABASE_ANON_KEY", "test.anon.key")
+os.environ.setdefault("VITE_GEMINI_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 1x1 grayscale PNG. Kept here rather than imported from test_backend.py, which opens a live
+# httpx.Client against the dev server at import time.
+DUMMY_PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP6DwABBAEKKfv5jAAAAABJRU5ErkJggg==")
@@ -0,0 +1,78 @@
+from fastapi.testclient import TestClient
+
+import main
+from conftest import DUMMY_PNG
+
+client = TestClient(main.app)
+
+
+def verdict(status, **overrides):
+    return {
+        "status": status,
+        "item_identified": "Omron BP Monitor",
+        "safety_score": 8,
+        "flaws_found": [],
+        "reason": "",
+        "missing_evidence": None,
+        **overrides,
+    }
+
+
+def upload(n):
+    return [("images", (f"photo{i}.png", DUMMY_PNG, "image/png")) for i in range(n)]
+
+
+def test_merge_audit_verdicts_takes_lowest_score_and_unions_flaws():
+    result = main.merge_audit_verdicts([
+        verdict("verified", safety_score=9, flaws_found=["scratch"]),
+        verdict("verified", safety_score=6, flaws_found=["scratch", "dent"]),
+    ])
+    assert result["status"] == "verified"
+    assert result["safety_score"] == 6
+    assert result["flaws_found"] == ["scratch", "dent"]
+
+
+def test_merge_audit_verdicts_is_strictest_first():
+    unclear = verdict("needs_more_info", missing_evidence="Too blurry to read the screen")
+    result = main.merge_audit_verdicts([verdict("verified"), unclear])
+    assert result["status"] == "needs_more_info"
+    assert result["missing_evidence"] == "Too blurry to read the screen"
+
+    result = main.merge_audit_verdicts([verdict("verified"), unclear, verdict("rejected")])
+    assert result["status"] == "rejected"
+
+
+def test_audit_item_failed_image_blocks_verification(monkeypatch):
+    calls = []
+
+    async def flaky_call_gemini(contents, schema=None):
+        calls.append(contents)
+        if len(calls) == 1:
+            raise RuntimeError("Gemini unavailable")
+        return verdict("verified")
+
+    monkeypatch.setattr(main, "call_gemini", flaky_call_gemini)
+    response = client.post("/audit-item", files=upload(4))
+    assert response.status_code == 200
+    assert response.json()["status"] == "needs_more_info"
+
+
+def test_audit_item_returns_merged_verdict(monkeypatch):
+    async def fake_call_gemini(contents, schema=None):
+        return verdict("verified")
+
+    monkeypatch.setattr(main, "call_gemini", fake_call_gemini)
+    response = client.post("/audit-item", files=upload(2))
+    assert response.status_code == 200
+    assert response.json()["status"] == "verified"
+
+
+def test_audit_item_requires_two_images():
+    response = client.post("/audit-item", files=upload(1))
+    assert response.status_code == 400
+
+
+def test_audit_item_rejects_non_image_bytes():
+    files = upload(1) + [("images", ("notes.png", b"PK\x03\x04 not an image", "image/png"))]
+    response = client.post("/audit-item", files=files)
+    assert response.status_code == 415
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import main
+
+
+def test_resume_batch_jobs_polls_each_recorded_job_once(monkeypatch):
+    polled = []
+
+    async def fake_run_query(query):
+        return SimpleNamespace(data=[{"ai_batch_job": "batches/a"}, {"ai_batch_job": "batches/a"}, {"ai_batch_job": "batches/b"}])
+
+    async def fake_apply_batch_results(job_name):
+        polled.append(job_name)
+
+    monkeypatch.setattr(main, "run_query", fake_run_query)
+    monkeypatch.setattr(main, "apply_batch_results", fake_apply_batch_results)
+
+    async def scenario():
+        await main.resume_batch_jobs()
+        await asyncio.gather(*main.BATCH_POLLERS.values())
+
+    asyncio.run(scenario())
+    assert sorted(polled) == ["batches/a", "batches/b"]
+    assert main.BATCH_POLLERS == {}
+
+
+def test_write_batch_jsonl_streams_usable_lines(monkeypatch):
+    async def fake_build_batch_request(client, item):
+        return {"key": item["id"]} if item.get("images") else None
+
+    monkeypatch.setattr(main, "build_batch_request", fake_build_batch_request)
+    monkeypatch.setattr(main.app.state, "http", None, raising=False)
+    items = [{"id": "1", "images": ["x"]}, {"id": "2", "images": []}, {"id": "3", "images": ["y"]}]
+
+    path, keys = asyncio.run(main.write_batch_jsonl(items))
+    try:
+        assert sorted(keys) == ["1", "3"]
+        with open(path) as f:
+            assert sorted(f.read().splitlines()) == ['{"key": "1"}', '{"key": "3"}']
+    finally:
+        os.remove(path)
+
+
+class RecordingTable:
+    """Stands in for supabase.table(...): records each update and its filters."""
+
+    def __init__(self, updates):
+        self.updates = updates
+
+    def update(self, values):
+        self.updates.append((values, []))
+        return self
+
+    def eq(self, column, value):
+        self.updates[-1][1].append((column, value))
+        return self
+
+
+def test_apply_batch_results_is_scoped_to_the_job(monkeypatch):
+    updates = []
+    good = {"key": "item-1", "response": {"candidates": [{"content": {"parts": [{"text": '{"status": "verified", "safety_score": 9}'}]}}]}}
+    bad = {"key": "item-2", "error": "blocked"}
+    raw = (json.dumps(good) + "\n" + json.dumps(bad) + "\n").encode()
+
+    job = SimpleNamespace(state=SimpleNamespace(name="JOB_STATE_SUCCEEDED"), dest=SimpleNamespace(file_name="files/out"))
+    batch_client = SimpleNamespace(
+        batches=SimpleNamespace(get=lambda name: job),
+        files=SimpleNamespace(download=lambda file: raw),
+    )
+
+    async def fake_run_query(query):
+        return SimpleNamespace(data=[])
+
+    monkeypatch.setattr(main, "batch_client", batch_client)
+    monkeypatch.setattr(main, "supabase", SimpleNamespace(table=lambda name: RecordingTable(updates)))
+    monkeypatch.setattr(main, "run_query", fake_run_query)
+
+    asyncio.run(main.apply_batch_results("batches/old"))
+
+    verdict_update, verdict_filters = updates[0]
+    assert verdict_update["ai_status"] == "verified"
+    assert verdict_filters == [("id", "item-1"), ("ai_batch_job", "batches/old")]
+    # The unusable entry is released by the final job-wide clear
+    assert updates[-1] == ({"ai_batch_job": None}, [("ai_batch_job", "batches/old")])
@@ -0,0 +1,69 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from conftest import DUMMY_PNG
+
+client = TestClient(main.app)
+
+LISTING_FORM = {
+    "title": "Walker",
+    "category": "Mobility",
+    "description": "Foldable walker",
+    "price": "100",
+    "location": "Pune",
+    "verified": "true",
+    "safety_score": "8",
+    "owner_id": "00000000-0000-0000-0000-000000000001",
+}
+
+
+def grant_for(item_id, paths, expires=None):
+    expires = expires or int(time.time()) + 60
+    return f"{expires}.{main.sign_upload_grant(item_id, paths, expires)}"
+
+
+def test_upload_grant_round_trip():
+    paths = ["abc/originals/0-front.jpg"]
+    assert main.verify_upload_grant("abc", paths, grant_for("abc", paths))
+
+
+def test_upload_grant_rejects_other_item_paths_and_expiry():
+    paths = ["abc/originals/0-front.jpg"]
+    grant = grant_for("abc", paths)
+    assert not main.verify_upload_grant("victim", paths, grant)
+    assert not main.verify_upload_grant("abc", ["abc/originals/1-side.jpg"], grant)
+    assert not main.verify_upload_grant("abc", paths, grant_for("abc", paths, expires=int(time.time()) - 1))
+    assert not main.verify_upload_grant("abc", paths, None)
+
+
+def test_create_listing_rejects_item_id_with_multipart_images():
+    response = client.post(
+        "/create-listing",
+        data={**LISTING_FORM, "item_id": "../victim-item"},
+        files=[("images", ("front.png", DUMMY_PNG, "image/png"))],
+    )
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_create_listing_rejects_unsigned_item_id():
+    response = client.post(
+        "/create-listing",
+        data={**LISTING_FORM, "item_id": "victim", "image_paths": '["victim/front.jpg"]'},
+    )
+    assert response.status_code == 403
+    assert "error" in response.json()
+
+
+def test_sign_caps_image_count():
+    filenames = [f"{i}.jpg" for i in range(main.MAX_IMAGES_PER_REQUEST + 1)]
+    response = client.post("/create-listing/sign", json={"filenames": filenames})
+    assert response.status_code == 413
+
+
+def test_sniffed_type_keeps_heic_originals_typed():
+    assert main.sniff_image_type(b"\x00\x00\x00\x18ftypheic") == "image/heic"
+    assert main.sniff_image_type(DUMMY_PNG[:12]) == "image/png"
+    assert main.sniff_image_type(b"not an image") is None
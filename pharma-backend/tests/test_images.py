@@ -0,0 +1,33 @@
+import io
+
+from PIL import Image
+
+import main
+
+
+def png_bytes(mode, size, color):
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_resize_image_caps_longest_edge():
+    resized = main.resize_image(png_bytes("RGB", (3000, 1500), "red"), main.THUMB_IMAGE_EDGE)
+    with Image.open(io.BytesIO(resized)) as img:
+        assert img.format == "JPEG"
+        assert img.size == (400, 200)
+
+
+def test_resize_image_puts_transparency_on_white():
+    resized = main.resize_image(png_bytes("RGBA", (10, 10), (0, 0, 0, 0)), main.THUMB_IMAGE_EDGE)
+    with Image.open(io.BytesIO(resized)) as img:
+        assert img.getpixel((5, 5)) == (255, 255, 255)
+
+
+def test_resize_variants_returns_sizes_in_requested_order():
+    full, thumb = main.resize_variants(
+        png_bytes("RGB", (3000, 1500), "red"), (main.LISTING_IMAGE_EDGE, main.THUMB_IMAGE_EDGE)
+    )
+    with Image.open(io.BytesIO(full)) as full_img, Image.open(io.BytesIO(thumb)) as thumb_img:
+        assert full_img.size == (1600, 800)
+        assert thumb_img.size == (400, 200)
@@ -0,0 +1,28 @@
+import asyncio
+import time
+import warnings
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_warm_up_gemini_gives_up_after_timeout(monkeypatch):
+    class HangingModel:
+        async def generate_content_async(self, *args, **kwargs):
+            await asyncio.sleep(60)
+
+    monkeypatch.setattr(main, "model", HangingModel())
+    monkeypatch.setattr(main, "GEMINI_WARMUP_TIMEOUT", 0.1)
+
+    started = time.monotonic()
+    asyncio.run(main.warm_up_gemini())
+    assert time.monotonic() - started < 5
+
+
+def test_default_response_class_serializes_with_orjson():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        response = TestClient(main.app).get("/")
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {"status": "ok", "service": "Pharma Grid Backend"}
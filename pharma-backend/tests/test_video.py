@@ -0,0 +1,23 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+from fastapi import UploadFile
+
+import main
+
+
+def test_upload_gemini_file_times_out_while_processing(monkeypatch):
+    processing = SimpleNamespace(name="files/stuck", state=SimpleNamespace(name="PROCESSING"))
+    deleted = []
+    monkeypatch.setattr(main.genai, "upload_file", lambda *args, **kwargs: processing)
+    monkeypatch.setattr(main.genai, "get_file", lambda name: processing)
+    monkeypatch.setattr(main.genai, "delete_file", deleted.append)
+    monkeypatch.setattr(main, "FILE_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(main, "FILE_PROCESSING_TIMEOUT", 0.05)
+
+    video = UploadFile(io.BytesIO(b"video"), filename="clip.mp4")
+    with pytest.raises(TimeoutError):
+        asyncio.run(main.upload_gemini_file(video))
+    assert deleted == ["files/stuck"]
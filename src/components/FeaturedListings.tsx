@@ -8,6 +8,7 @@ interface Listing {
   title: string;
   price_per_day: number;
   image_url: string;
+  thumb_url?: string | null; // 400px cover, cheaper for the grid
   address_text: string;
   lat: number;
   lng: number;
@@ -154,7 +155,7 @@ const FeaturedListings = () => {
                 {/* Image Container */}
                 <div className="relative aspect-[4/3] overflow-hidden">
                   <img
-                    src={listing.image_url || "https://images.unsplash.com/photo-1584515933487-779824d29309?w=400&h=300&fit=crop"}
+                    src={listing.thumb_url || listing.image_url || "https://images.unsplash.com/photo-1584515933487-779824d29309?w=400&h=300&fit=crop"}
                     alt={listing.title}
                     className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                   />
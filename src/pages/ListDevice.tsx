@@ -222,12 +222,30 @@ const ListDevice = () => {
             return;
         }
 
-        // Re-send images to be saved/handled by backend creation endpoint
-        files.forEach((file) => {
-            data.append("images", file);
-        });
-
         try {
+            // Upload images straight to Supabase Storage via signed URLs so the
+            // bytes don't have to be re-sent through the backend.
+            const signRes = await fetch(`${API_BASE_URL}/create-listing/sign`, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ filenames: files.map((file) => file.name) }),
+            });
+            const signed = await signRes.json();
+            if (!signRes.ok) throw new Error(signed.error || "Failed to prepare image upload");
+
+            await Promise.all(
+                signed.uploads.map(async (upload: { path: string; token: string }, i: number) => {
+                    const { error } = await supabase.storage
+                        .from("device-images")
+                        .uploadToSignedUrl(upload.path, upload.token, files[i]);
+                    if (error) throw error;
+                })
+            );
+
+            data.append("item_id", signed.itemId);
+            data.append("upload_grant", signed.uploadGrant);
+            data.append("image_paths", JSON.stringify(signed.uploads.map((upload: { path: string }) => upload.path)));
+
             const response = await fetch(`${API_BASE_URL}/create-listing`, {
                 method: "POST",
                 body: data,